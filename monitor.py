@@ -4,16 +4,29 @@ Migration Monitor - Watches remote bot and sends notifications.
 Bot runs autonomously on server, this script monitors and restarts if needed.
 """
 
+import atexit
 import subprocess
+import http.client
 import json
 import time
 import os
+import re
+import selectors
+import signal
 import sys
+import threading
 import fcntl
+from functools import partial
 from dataclasses import dataclass
 from pathlib import Path
 from datetime import datetime
 from typing import Optional
+from urllib.parse import urlsplit
+
+try:
+    import orjson  # optional: faster JSON for the RPC hot path
+except ImportError:
+    orjson = None
 
 
 def load_dotenv(path: str = ".env") -> dict:
@@ -25,7 +38,9 @@ def load_dotenv(path: str = ".env") -> dict:
                 line = line.strip()
                 if line and not line.startswith("#") and "=" in line:
                     key, _, value = line.partition("=")
-                    value = value.strip().strip('"').strip("'")
+                    value = value.strip()
+                    if len(value) >= 2 and value[0] in "\"'" and value[-1] == value[0]:
+                        value = value[1:-1]
                     env[key.strip()] = value
     except FileNotFoundError:
         pass
@@ -41,20 +56,27 @@ class Config:
     # Server
     server: str = "devbox"
     ssh_timeout: int = 30
+    control_path: str = "/tmp/monitor-ssh-%r@%h:%p"  # ControlMaster socket
+    control_persist: str = "10m"
 
     # Paths
     remote_log: str = "/tmp/westend-migrate.log"
+    remote_pidfile: str = "/tmp/migration-bot.pid"
     local_log: str = "migration.log"
     lockfile: str = "/tmp/monitor.lock"
-    seed_file: str = "/tmp/.migration_seed"
 
     # Monitoring
     check_interval: int = 60  # seconds between checks
-    max_stalls: int = 5       # restart after this many checks with no progress
+    max_check_interval: int = 600   # cap for backoff while nothing changes
+    restart_check_interval: int = 15  # quick re-check after (re)starting the bot
+    max_stalls: int = 5       # restart after max_stalls * check_interval seconds with no progress
+    keys_ttl: int = 300       # seconds to reuse the last trie migration status
+    keys_stall_refresh: int = 2  # rescan the trie every check once stalled this long
 
     # RPC
     rpc_url: str = "ws://127.0.0.1:9944"
-    rpc_http: str = "http://127.0.0.1:9944"
+    rpc_http: str = "http://127.0.0.1:9944"  # as seen from the server
+    rpc_local_port: int = 19944  # local end of the SSH port forward
     account: str = ""  # Set from SIGNER_ACCOUNT env var
 
     # Bot settings
@@ -63,19 +85,45 @@ class Config:
 
 
 config = Config()
-lockfile_handle = None
+lockfile_fd: Optional[int] = None
+log_fd: Optional[int] = None
+ssh_master = None
+keys_cache: tuple[Optional[int], float] = (None, 0.0)  # (keys remaining, fetched at)
+log_stream = None
+log_buffer = b""  # trailing partial line from the log stream
+log_offset: Optional[int] = None  # bytes of the remote log consumed so far
+log_stream_synced = False  # whether the stream's start-offset header was read
+log_selector = selectors.DefaultSelector()  # wakes the main loop on new log output
+rpc_conns: dict[str, http.client.HTTPConnection] = {}  # keep-alive connection per RPC method
+rpc_forwarded: Optional[bool] = None  # local RPC port forward in place (None: not tried)
+running_cmd = ""  # per-cycle remote commands, see build_remote_commands()
+poll_script = ""
 
 # ============================================================================
 # UTILITIES
 # ============================================================================
 
+def open_log():
+    """Open the local log once and keep it for the process lifetime."""
+    global log_fd
+    if log_fd is None:
+        # O_APPEND makes each write an atomic append, even across monitor instances
+        log_fd = os.open(config.local_log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        atexit.register(os.close, log_fd)
+
+
+def write_log(text: str):
+    """Append raw text to the local log in a single write."""
+    open_log()
+    os.write(log_fd, text.encode())
+
+
 def log(msg: str):
     """Log message to file and stdout."""
     timestamp = datetime.now().strftime("%H:%M:%S")
     line = f"[{timestamp}] {msg}"
     print(line)
-    with open(config.local_log, "a") as f:
-        f.write(line + "\n")
+    write_log(line + "\n")
 
 
 def notify(title: str, message: str, urgency: str = "normal", timeout: int = 5000):
@@ -90,13 +138,25 @@ def notify(title: str, message: str, urgency: str = "normal", timeout: int = 500
         pass
 
 
-def ssh(cmd: str, timeout: int = None, retries: int = 3) -> tuple[bool, str]:
+def ssh_args(*opts: str) -> list[str]:
+    """Build an ssh argv that multiplexes over the shared control socket."""
+    return [
+        "ssh",
+        "-o", f"ControlPath={config.control_path}",
+        "-o", "ControlMaster=auto",
+        *opts,
+        config.server,
+    ]
+
+
+def ssh(cmd: str, timeout: int = None, retries: int = 3, stdin: str = None) -> tuple[bool, str]:
     """Run SSH command with retries, return (success, output)."""
     timeout = timeout or config.ssh_timeout
     for attempt in range(retries):
         try:
             result = subprocess.run(
-                ["ssh", config.server, cmd],
+                ssh_args() + [cmd],
+                input=stdin,
                 capture_output=True,
                 text=True,
                 timeout=timeout
@@ -114,60 +174,347 @@ def ssh(cmd: str, timeout: int = None, retries: int = 3) -> tuple[bool, str]:
     return False, ""
 
 
-def rpc_call(method: str, params: list = None, timeout: int = 10) -> Optional[dict]:
-    """Make RPC call via SSH curl."""
-    params = params or []
-    payload = json.dumps({"jsonrpc": "2.0", "id": 1, "method": method, "params": params})
-    cmd = f"curl -s --max-time {timeout} -H 'Content-Type: application/json' -d '{payload}' {config.rpc_http}"
-    ok, output = ssh(cmd, timeout + 5)
-    if ok and output:
+def parse_rpc(output: bytes) -> Optional[dict]:
+    """Parse a JSON-RPC response body."""
+    if output:
         try:
-            return json.loads(output)
-        except json.JSONDecodeError:
+            return orjson.loads(output) if orjson else json.loads(output)
+        except ValueError:
             pass
     return None
 
 
+def rpc_payload(method: str, params: list = None) -> bytes:
+    """Encode a JSON-RPC request body."""
+    request = {"jsonrpc": "2.0", "id": 1, "method": method, "params": params or []}
+    return orjson.dumps(request) if orjson else json.dumps(request).encode()
+
+
+# Request bodies for the per-cycle RPCs, encoded once in main()
+keys_payload = b""
+nonce_payload = b""
+
+
+def rpc_call(method: str, params: list = None, timeout: int = 10, payload: bytes = None) -> Optional[dict]:
+    """Make RPC call over the forwarded port, falling back to curl over SSH.
+
+    A pre-encoded payload skips building the request body. If the forward
+    is missing or refuses connections it is re-established once before the
+    fallback, so progress tracking never goes blind.
+    """
+    payload = payload or rpc_payload(method, params)
+    if rpc_forwarded:
+        reached, result = rpc_post(method, payload, timeout)
+        if reached:
+            return result
+    if forward_rpc():
+        reached, result = rpc_post(method, payload, timeout)
+        if reached:
+            return result
+    return rpc_over_ssh(payload, timeout)
+
+
+def rpc_post(method: str, payload: bytes, timeout: int) -> tuple[bool, Optional[dict]]:
+    """POST to the forwarded port, return (reached, response).
+
+    Each method gets its own keep-alive connection so concurrent checks never
+    share a socket. A timeout counts as reached: the node is just slow.
+    """
+    # A kept-alive connection may have been dropped by the node; retry once on a new one
+    for attempt in range(2):
+        try:
+            conn = rpc_conns.get(method)
+            if conn is None:
+                conn = http.client.HTTPConnection("127.0.0.1", config.rpc_local_port, timeout=timeout)
+                rpc_conns[method] = conn
+            if conn.sock is None:  # never connected, or closed after "Connection: close"
+                conn.connect()
+            conn.sock.settimeout(timeout)
+            conn.request("POST", "/", payload, {"Content-Type": "application/json"})
+            return True, parse_rpc(conn.getresponse().read())
+        except TimeoutError:
+            close_rpc(method)
+            return True, None
+        except (OSError, http.client.HTTPException):
+            close_rpc(method)
+    return False, None
+
+
+def rpc_over_ssh(payload: bytes, timeout: int) -> Optional[dict]:
+    """Make RPC call via curl on the server (payload sent over stdin)."""
+    cmd = f"curl -s --max-time {timeout} -H 'Content-Type: application/json' -d @- {config.rpc_http}"
+    ok, output = ssh(cmd, timeout + 5, stdin=payload.decode())
+    return parse_rpc(output) if ok else None
+
+
+def close_rpc(method: str = None):
+    """Drop the keep-alive RPC connection for a method, or all of them."""
+    for name in [method] if method else list(rpc_conns):
+        conn = rpc_conns.pop(name, None)
+        if conn:
+            conn.close()
+
+
+def gather(*calls) -> list:
+    """Run independent checks concurrently and return their results in order.
+
+    Checks run on daemon threads, so Ctrl-C or SIGTERM exits right away
+    instead of waiting out an in-flight SSH retry or trie scan.
+    """
+    results = [None] * len(calls)
+    errors = []
+
+    def run(i, call):
+        try:
+            results[i] = call()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i, call), daemon=True) for i, call in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+# ============================================================================
+# SSH MASTER CONNECTION
+# ============================================================================
+
+def ssh_control(op: str, *opts: str, timeout: int = 5) -> bool:
+    """Send a control command (check/forward/exit) to the master connection."""
+    try:
+        result = subprocess.run(
+            ["ssh", "-O", op, "-o", f"ControlPath={config.control_path}", *opts, config.server],
+            capture_output=True,
+            timeout=timeout
+        )
+        return result.returncode == 0
+    except Exception:
+        return False
+
+
+def start_master() -> bool:
+    """Start a background master connection for later ssh calls to reuse."""
+    global ssh_master
+    stop_master()
+    try:
+        ssh_master = subprocess.Popen(
+            [
+                "ssh", "-M", "-N",
+                "-o", "ControlMaster=yes",
+                "-o", f"ControlPersist={config.control_persist}",
+                "-o", f"ControlPath={config.control_path}",
+                config.server,
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    except Exception:
+        ssh_master = None
+        return False
+
+    # Wait for the control socket to come up
+    deadline = time.time() + config.ssh_timeout
+    while time.time() < deadline:
+        if ssh_control("check"):
+            close_rpc()
+            forward_rpc()
+            return True
+        if ssh_master.poll() is not None:
+            break
+        time.sleep(0.5)
+    return False
+
+
+def forward_rpc() -> bool:
+    """Forward the local RPC port to the node through the master connection."""
+    global rpc_forwarded
+    rpc = urlsplit(config.rpc_http)
+    forward = f"{config.rpc_local_port}:{rpc.hostname}:{rpc.port or 80}"
+    ok = ssh_control("forward", "-L", forward)
+    if not ok and rpc_forwarded is not False:
+        log(f"ERROR: Failed to forward RPC port {forward}, using curl over SSH")
+    rpc_forwarded = ok
+    return ok
+
+
+def ensure_master():
+    """Restart the master connection if its control socket is gone."""
+    if ssh_control("check"):
+        return
+    log("SSH master connection lost, reconnecting...")
+    if not start_master():
+        log("SSH master unavailable, falling back to direct connections")
+
+
+def stop_master():
+    """Tear down the master connection."""
+    global ssh_master, rpc_forwarded
+    close_rpc()
+    rpc_forwarded = None
+    ssh_control("exit")
+    if ssh_master and ssh_master.poll() is None:
+        try:
+            ssh_master.terminate()
+            ssh_master.wait(timeout=5)
+        except Exception:
+            pass
+    ssh_master = None
+
+
+# ============================================================================
+# REMOTE LOG STREAM
+# ============================================================================
+
+def start_log_stream() -> bool:
+    """Follow the remote bot log with a long-lived tail -F over SSH.
+
+    The stream resumes at log_offset, so lines written while it was down are
+    not lost; on first start it begins at the current end of the log. The
+    remote side echoes the byte offset it starts from as a header line.
+    """
+    global log_stream, log_buffer, log_stream_synced
+    stop_log_stream()
+    log_buffer = b""
+    log_stream_synced = False
+    start = "$SIZE" if log_offset is None else str(log_offset)
+    cmd = (
+        f"SIZE=$(stat -c %s {config.remote_log} 2>/dev/null || echo 0); "
+        f"START={start}; [ \"$START\" -gt \"$SIZE\" ] && START=0; "  # log was truncated
+        f"echo \"$START\"; "
+        f"exec tail -c +$((START + 1)) -F {config.remote_log}"
+    )
+    try:
+        log_stream = subprocess.Popen(
+            ssh_args() + [cmd],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+    except Exception:
+        log_stream = None
+        return False
+    os.set_blocking(log_stream.stdout.fileno(), False)
+    log_selector.register(log_stream.stdout, selectors.EVENT_READ)
+    return True
+
+
+def unwatch_log_stream():
+    """Stop waking up on the log stream (it is closed or at EOF)."""
+    try:
+        log_selector.unregister(log_stream.stdout)
+    except (KeyError, ValueError, AttributeError):
+        pass
+
+
+def ensure_log_stream():
+    """Restart the log stream if the tail process has exited."""
+    if log_stream is None or log_stream.poll() is not None:
+        if not start_log_stream():
+            log("ERROR: Failed to start remote log stream")
+
+
+def read_log_stream() -> list[str]:
+    """Drain complete lines available on the log stream without blocking."""
+    global log_buffer, log_offset, log_stream_synced
+    if log_stream is None:
+        return []
+
+    fd = log_stream.stdout.fileno()
+    chunks = [log_buffer]
+    while True:
+        try:
+            chunk = os.read(fd, 65536)
+        except BlockingIOError:
+            break
+        if not chunk:  # EOF - ensure_log_stream() restarts it
+            unwatch_log_stream()
+            break
+        chunks.append(chunk)
+
+    *lines, log_buffer = b"".join(chunks).split(b"\n")
+    if lines and not log_stream_synced:
+        header = lines.pop(0)
+        log_offset = int(header) if header.isdigit() else 0
+        log_stream_synced = True
+    if lines:
+        log_offset += sum(len(line) + 1 for line in lines)
+    return [line.decode(errors="replace") for line in lines]
+
+
+def reset_log_offset():
+    """Mark the remote log as truncated (the bot rewrites it on start)."""
+    global log_offset
+    log_offset = 0
+
+
+def stop_log_stream():
+    """Stop following the remote log."""
+    global log_stream
+    unwatch_log_stream()
+    if log_stream and log_stream.poll() is None:
+        try:
+            log_stream.terminate()
+            log_stream.wait(timeout=5)
+        except Exception:
+            pass
+    log_stream = None
+
+
 # ============================================================================
 # BOT MANAGEMENT
 # ============================================================================
 
 def is_bot_running() -> bool:
     """Check if bot process is running on remote."""
-    ok, output = ssh("pgrep -f westend-migrate", timeout=10)
+    if not running_cmd:
+        build_remote_commands()
+    ok, output = ssh("bash -s", timeout=10, stdin=running_cmd + "\n")
     return ok and output.strip() != ""
 
 
+def bot_running_cmd() -> str:
+    """Remote check that prints something iff the bot is running.
+
+    Probes the PID written by start_bot() first; pgrep is only the fallback
+    for a bot started some other way. It matches the exact process name, so
+    neither the shell running this nor the log stream's tail counts.
+    """
+    return (
+        f"kill -0 $(cat {config.remote_pidfile} 2>/dev/null) 2>/dev/null && echo up"
+        f" || pgrep -x westend-migrate || true"  # no match is an answer, not an ssh failure
+    )
+
+
 def stop_bot():
     """Stop bot on remote."""
-    ssh("pkill -f westend-migrate", timeout=10)
+    ssh(f"rm -f {config.remote_pidfile}; pkill -x westend-migrate; true", timeout=10)
     log("Bot stopped")
 
 
 def start_bot(seed: str) -> bool:
-    """Start bot on remote with seed passed via temp file."""
+    """Start bot on remote with seed passed over SSH stdin."""
     log("Starting bot on remote...")
 
-    # Write seed to temp file
-    ok, _ = ssh(f"echo '{seed}' > {config.seed_file} && chmod 600 {config.seed_file}")
-    if not ok:
-        log("ERROR: Failed to write seed file")
-        return False
-
-    # Start bot reading seed from file then deleting it
+    # Seed never touches the command line or disk: the remote shell reads it from
+    # stdin in the foreground, and only the launch itself is backgrounded
     start_cmd = (
-        f"cd ~ && nohup bash -c '"
-        f"export SIGNER_SEED=\"$(cat {config.seed_file})\"; "
-        f"rm -f {config.seed_file}; "
-        f"{config.bot_binary} {config.bot_args} 2>&1"
-        f"' > {config.remote_log} 2>&1 &"
+        f"cd ~ && read -r SIGNER_SEED && export SIGNER_SEED && {{ "
+        f"nohup {config.bot_binary} {config.bot_args} < /dev/null > {config.remote_log} 2>&1 & "
+        f"echo $! > {config.remote_pidfile}; }}"
     )
 
-    ok, _ = ssh(start_cmd, timeout=15)
+    ok, _ = ssh(start_cmd, timeout=15, stdin=seed + "\n")
     if not ok:
         log("ERROR: Failed to start bot")
         return False
 
+    reset_log_offset()
     time.sleep(3)
     if is_bot_running():
         log("Bot started successfully")
@@ -181,96 +528,242 @@ def start_bot(seed: str) -> bool:
 # MONITORING FUNCTIONS
 # ============================================================================
 
-def get_nonce() -> Optional[int]:
-    """Get current account nonce."""
-    result = rpc_call("system_accountNextIndex", [config.account])
+def nonce_from(result: Optional[dict]) -> Optional[int]:
+    """Extract the account nonce from a system_accountNextIndex response."""
     if result and "result" in result:
         return result["result"]
     return None
 
 
-def get_keys_remaining() -> Optional[int]:
-    """Get remaining keys to migrate (slow - scans trie)."""
-    result = rpc_call("state_trieMigrationStatus", [], timeout=40)
+def keys_from(result: Optional[dict]) -> Optional[int]:
+    """Extract remaining keys from a state_trieMigrationStatus response."""
     if result and "result" in result:
         return result["result"].get("topRemainingToMigrate")
     return None
 
 
-def get_new_dad_jokes(last_line: int) -> tuple[list[str], int]:
-    """Get new dad jokes from remote log."""
-    ok, output = ssh(f"wc -l < {config.remote_log}")
-    if not ok:
-        return [], last_line
+def get_nonce() -> Optional[int]:
+    """Get current account nonce."""
+    return nonce_from(rpc_call("system_accountNextIndex", [config.account], payload=nonce_payload))
 
-    try:
-        total_lines = int(output.strip())
-    except ValueError:
-        return [], last_line
 
-    if total_lines <= last_line:
-        return [], last_line
+def keys_cache_fresh() -> bool:
+    """Check whether the cached remaining-keys value is still usable."""
+    value, fetched_at = keys_cache
+    return value is not None and time.time() - fetched_at < config.keys_ttl
 
-    ok, output = ssh(f"tail -n +{last_line + 1} {config.remote_log}")
-    if not ok:
-        return [], last_line
 
-    jokes = []
-    for line in output.split("\n"):
-        if "\U0001f493" in line:  # heart emoji
-            joke = line.split("\U0001f493")[-1].strip()
-            if joke:
-                jokes.append(joke)
+def cache_keys(value: Optional[int]):
+    """Remember a freshly fetched remaining-keys value."""
+    global keys_cache
+    if value is not None:
+        keys_cache = (value, time.time())
 
-    return jokes, total_lines
 
+def get_keys_remaining(force: bool = False) -> Optional[int]:
+    """Get remaining keys to migrate (slow - scans trie, cached for keys_ttl)."""
+    if not force and keys_cache_fresh():
+        return keys_cache[0]
+    value = keys_from(rpc_call("state_trieMigrationStatus", timeout=40, payload=keys_payload))
+    cache_keys(value)
+    return value
 
-def check_for_errors() -> Optional[dict]:
-    """Check for critical errors in bot log."""
-    ok, output = ssh(f"tail -50 {config.remote_log}")
-    if not ok:
-        return None
 
-    if "Balance decreased" in output or "SLASHING" in output:
+# Everything the monitor looks for in the bot log, matched in one scan.
+# "5/5" (last retry) and "consecutive" (bot giving up) are on separate lines.
+ALERT_RE = re.compile(
+    r"\U0001f493(?P<joke>[^\n]*)"  # heart emoji
+    r"|(?P<slashing>Balance decreased|SLASHING)"
+    r"|(?P<gave_up>Too many consecutive errors)"
+    r"|(?P<last_retry>5/5)"
+    r"|(?P<consecutive>(?i:consecutive))"
+)
+
+
+def check_for_errors(alerts: set[str]) -> Optional[dict]:
+    """Check the alert kinds matched in bot log output for critical errors."""
+    if "slashing" in alerts:
         return {"critical": True, "msg": "Balance decreased - possible slashing!"}
 
-    if "5/5" in output and "consecutive" in output.lower():
+    if "gave_up" in alerts or ("last_retry" in alerts and "consecutive" in alerts):
         return {"critical": True, "msg": "Max retries reached"}
 
     return None
 
 
+def check_delay(idle_cycles: int) -> int:
+    """Seconds until the next check, doubling per idle check (up to 8x)."""
+    return min(config.check_interval * (1 << min(idle_cycles, 3)), config.max_check_interval)
+
+
+def scan_log_lines(lines: list[str]) -> tuple[list[str], Optional[dict]]:
+    """Pick dad jokes and critical errors out of new bot log lines."""
+    jokes = []
+    alerts = set()
+    for match in ALERT_RE.finditer("\n".join(lines)):
+        if match.lastgroup == "joke":
+            joke = match.group("joke").strip()
+            if joke:
+                jokes.append(joke)
+        else:
+            alerts.add(match.lastgroup)
+    return jokes, check_for_errors(alerts)
+
+
+def watch_log(deadline: float) -> Optional[dict]:
+    """Forward log events as they arrive until deadline.
+
+    Blocks on the log stream instead of sleeping, so jokes and critical
+    errors surface immediately. Returns early with the critical status if one
+    is seen.
+    """
+    while True:
+        jokes, status = scan_log_lines(read_log_stream())
+        if jokes:
+            log(f"Forwarding {len(jokes)} dad joke(s)")
+        for joke in jokes:
+            notify("Dad Joke", joke, urgency="low", timeout=8000)
+        if status and status.get("critical"):
+            return status
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return None
+        log_selector.select(remaining)
+
+
+POLL_SEPARATOR = "@@monitor-poll@@"
+POLL_SECTIONS = 2
+# Remote-side filters for the log backstop, most severe first: a single line
+# comes back, from the first filter that matches anything
+ALERT_GREPS = ("Balance decreased|SLASHING", "Too many consecutive errors")
+
+
+def poll_remote() -> Optional[dict]:
+    """Gather all per-cycle remote shell state in a single SSH round-trip.
+
+    The remote script prints one section per check, separated by
+    POLL_SEPARATOR lines. RPC state goes over the forwarded port instead.
+    "alert" is the first critical line in the log tail, a backstop for
+    anything the log stream missed while it was down. Returns None if the
+    server could not be reached.
+    """
+    if not poll_script:
+        build_remote_commands()
+    ok, output = ssh("bash -s", stdin=poll_script)
+    if not ok:
+        return None
+
+    sections = [[]]
+    for line in output.split("\n"):
+        if line == POLL_SEPARATOR:
+            sections.append([])
+        else:
+            sections[-1].append(line)
+    if len(sections) != POLL_SECTIONS:
+        return None
+    running, alert = ("\n".join(s).strip() for s in sections)
+
+    return {"running": running != "", "alert": alert}
+
+
+def build_remote_commands():
+    """Precompute the remote shell commands run every cycle.
+
+    Call again if config changes; they only depend on paths and settings.
+    """
+    global running_cmd, poll_script
+    running_cmd = bot_running_cmd()
+    poll_script = "\n".join([
+        running_cmd,
+        f"echo {POLL_SEPARATOR}",
+        " || ".join(
+            f"tail -50 {config.remote_log} 2>/dev/null | grep -m1 -E '{pattern}'"
+            for pattern in ALERT_GREPS
+        ),
+        "exit 0",
+    ]) + "\n"
+
+
 # ============================================================================
 # LOCK MANAGEMENT
 # ============================================================================
 
-def acquire_lock() -> bool:
-    """Acquire exclusive lock to prevent multiple instances."""
+def lock_holder() -> Optional[int]:
+    """Return the PID recorded in the lockfile, if any."""
     try:
-        global lockfile_handle
-        lockfile_handle = open(config.lockfile, "w")
-        fcntl.flock(lockfile_handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
-        return True
-    except (IOError, OSError):
+        with open(config.lockfile) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def pid_alive(pid: int) -> bool:
+    """Check whether a local process exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
         return False
+    except PermissionError:
+        pass  # exists, owned by someone else
+    return True
+
+
+def acquire_lock(retries: int = 3) -> bool:
+    """Acquire exclusive lock to prevent multiple instances.
+
+    The lockfile is opened without truncating, so a failed attempt can still
+    report the holder's PID. If the recorded holder is gone, the lock is
+    about to be released (or is held by an orphaned child) and is retried.
+    """
+    global lockfile_fd
+    try:
+        fd = os.open(config.lockfile, os.O_RDWR | os.O_CREAT, 0o644)
+    except OSError:
+        return False
+
+    for attempt in range(retries):
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            holder = lock_holder()
+            if holder is None or pid_alive(holder):
+                break
+            print(f"Stale lock from PID {holder}, retrying...")
+            time.sleep(1)
+            continue
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, f"{os.getpid()}\n".encode(), 0)
+        lockfile_fd = fd
+        return True
+
+    os.close(fd)
+    return False
 
 
 def release_lock():
     """Release the lock."""
-    global lockfile_handle
-    if lockfile_handle:
+    global lockfile_fd
+    if lockfile_fd is not None:
         try:
-            fcntl.flock(lockfile_handle, fcntl.LOCK_UN)
-            lockfile_handle.close()
+            fcntl.flock(lockfile_fd, fcntl.LOCK_UN)
+            os.close(lockfile_fd)
         except Exception:
             pass
+        lockfile_fd = None
 
 
 # ============================================================================
 # MAIN MONITOR LOOP
 # ============================================================================
 
+def handle_sigterm(signum, frame):
+    """Turn SIGTERM into the same clean shutdown as Ctrl-C."""
+    raise KeyboardInterrupt
+
+
 def main():
+    global keys_payload, nonce_payload
     # Load .env file directly
     dotenv = load_dotenv()
 
@@ -289,75 +782,109 @@ def main():
         config.server = server
 
     config.account = account
+    keys_payload = rpc_payload("state_trieMigrationStatus")
+    nonce_payload = rpc_payload("system_accountNextIndex", [account])
+    build_remote_commands()
     print(f"Using account: {account[:10]}...{account[-8:]}")
     print(f"Targeting server: {config.server}")
 
     # Acquire lock
     if not acquire_lock():
-        print("Another monitor instance is already running")
+        holder = lock_holder()
+        if holder and pid_alive(holder):
+            print(f"Another monitor instance is already running (lock held by PID {holder})")
+        else:
+            print("Lock is held by an unknown process")
         sys.exit(1)
 
-    # Initialize log
-    with open(config.local_log, "a") as f:
-        f.write(f"=== Migration Monitor Started ===\n")
-        f.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Monitoring {config.server}\n")
+    try:
+        # pkill (just stop-monitor, restart, ...) sends SIGTERM; tear down as on Ctrl-C
+        signal.signal(signal.SIGTERM, handle_sigterm)
+
+        # Initialize log
+        write_log(
+            f"=== Migration Monitor Started ===\n"
+            f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Monitoring {config.server}\n"
+        )
 
-    notify("Monitor Started", f"Watching migration on {config.server}")
+        notify("Monitor Started", f"Watching migration on {config.server}")
 
-    # Start bot if not running
-    if not is_bot_running():
-        if not start_bot(seed):
-            release_lock()
-            sys.exit(1)
+        # Open a shared connection so each check skips the SSH handshake
+        if not start_master():
+            log("SSH master unavailable, falling back to direct connections")
 
-    # Get initial state
-    raw_nonce = get_nonce()
-    raw_keys = get_keys_remaining()
+        # Follow the bot log so jokes and errors arrive as they are written
+        ensure_log_stream()
 
-    last_nonce = raw_nonce if raw_nonce is not None else 0
-    last_keys = raw_keys if raw_keys is not None else 0
-    last_log_line = 0
-    stall_count = 0
+        # Start bot if not running
+        if not is_bot_running():
+            if not start_bot(seed):
+                sys.exit(1)
 
-    log(f"Initial: nonce={last_nonce}, keys={last_keys}")
+        # Get initial state
+        raw_nonce, raw_keys = gather(get_nonce, get_keys_remaining)
+
+        last_nonce = raw_nonce if raw_nonce is not None else 0
+        last_keys = raw_keys if raw_keys is not None else 0
+        stall_count = 0
+        idle_cycles = 0  # like stall_count, but not reset by restarts; drives backoff
+        stall_window = config.max_stalls * config.check_interval
+        last_progress = time.time()
+        delay = config.check_interval
+
+        log(f"Initial: nonce={last_nonce}, keys={last_keys}")
 
-    try:
         while True:
-            time.sleep(config.check_interval)
+            # Wait for the next check, handling log output as it streams in
+            status = watch_log(time.time() + delay)
+            if status:
+                notify("CRITICAL", status["msg"], urgency="critical", timeout=0)
+                log(f"CRITICAL: {status['msg']} - stopping monitor")
+                break
+
+            ensure_master()
+            ensure_log_stream()
 
-            # Check SSH connectivity
-            ok, _ = ssh("echo ok", timeout=5)
-            if not ok:
+            # Fetch bot status and RPC state concurrently. A moving nonce already
+            # proves progress, so the trie is only rescanned once it stalls.
+            rescan_keys = stall_count >= config.keys_stall_refresh
+            poll, raw_nonce, raw_keys = gather(
+                poll_remote, get_nonce, partial(get_keys_remaining, force=rescan_keys)
+            )
+            if poll is None:
                 log("SSH connection failed, retrying...")
                 notify("SSH Failed", f"Cannot reach {config.server}", timeout=5000)
+                delay = config.check_interval
                 continue
 
-            # Check if bot is running
-            if not is_bot_running():
+            # Check if bot is running (answered by the poll above, which may have
+            # waited on a slow trie scan - its age doesn't matter here)
+            if not poll["running"]:
                 log("Bot not running, restarting...")
                 notify("Bot Stopped", "Restarting bot...")
                 start_bot(seed)
+                stall_count = 0
+                last_progress = time.time()
+                delay = config.restart_check_interval
                 continue
 
-            # Check for critical errors
-            status = check_for_errors()
+            # Catch critical errors logged while the stream was reconnecting
+            _, status = scan_log_lines([poll["alert"]])
             if status and status.get("critical"):
                 notify("CRITICAL", status["msg"], urgency="critical", timeout=0)
                 log(f"CRITICAL: {status['msg']} - stopping monitor")
                 break
 
-            # Forward dad jokes
-            jokes, last_log_line = get_new_dad_jokes(last_log_line)
-            if jokes:
-                log(f"Forwarding {len(jokes)} dad joke(s)")
-            for joke in jokes:
-                notify("Dad Joke", joke, urgency="low", timeout=8000)
+            # Without a nonce there is no progress signal; don't count it as a stall,
+            # and restart the stall window so the outage isn't blamed on the bot
+            if raw_nonce is None:
+                log("RPC unreachable, skipping stall check")
+                last_progress = time.time()
+                delay = config.check_interval
+                continue
 
             # Get current state
-            raw_nonce = get_nonce()
-            raw_keys = get_keys_remaining()
-
-            current_nonce = raw_nonce if raw_nonce is not None else last_nonce
+            current_nonce = raw_nonce
             current_keys = raw_keys if raw_keys is not None else last_keys
 
             nonce_diff = current_nonce - last_nonce
@@ -366,19 +893,29 @@ def main():
             log(f"nonce={current_nonce} (+{nonce_diff}) | keys={current_keys} (-{keys_diff})")
 
             # Check for stalls
+            # Stall window is measured in time, so backoff never delays a restart
             if nonce_diff == 0 and keys_diff == 0:
                 stall_count += 1
-                log(f"No progress, stall count: {stall_count}/{config.max_stalls}")
+                idle_cycles += 1
+                stalled_for = time.time() - last_progress
+                log(f"No progress for {stalled_for:.0f}s/{stall_window}s, stall count: {stall_count}")
 
-                if stall_count >= config.max_stalls:
+                if stalled_for >= stall_window:
                     log("Too many stalls, restarting bot...")
                     notify("Restarting", "Bot stalled, restarting...")
                     stop_bot()
                     time.sleep(2)
                     start_bot(seed)
                     stall_count = 0
+                    last_progress = time.time()
+                    delay = config.restart_check_interval
+                else:
+                    delay = min(check_delay(idle_cycles), stall_window - stalled_for)
             else:
                 stall_count = 0
+                idle_cycles = 0
+                last_progress = time.time()
+                delay = config.check_interval
                 # Notify on any progress
                 if nonce_diff > 0 or keys_diff > 0:
                     notify("Progress", f"{current_keys} keys left | +{nonce_diff} tx | -{keys_diff} keys")
@@ -387,8 +924,10 @@ def main():
             last_keys = current_keys
 
     except KeyboardInterrupt:
-        log("Monitor stopped by user")
+        log("Monitor stopped")
     finally:
+        stop_log_stream()
+        stop_master()
         release_lock()
 
 